@@ -20,17 +20,32 @@ SAMPLE_ROWS = [
     ["Belanja Modal", 1133163195359, 836917297001, 73.86, 2024]
 ]
 
-def make_template_excel():
+@st.cache_data(show_spinner=False)
+def build_template_bytes():
+    """Isi template konstan — tulis sekali, sajikan bytes dari cache."""
     df = pd.DataFrame(SAMPLE_ROWS, columns=TEMPLATE_COLUMNS)
     buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+    # xlsxwriter lebih ringan dari openpyxl; fallback ke openpyxl bila tak ada.
+    # Jangan pakai constant_memory: to_excel menulis per kolom, sedangkan mode
+    # itu mem-flush baris begitu baris berikutnya disentuh — sel jadi kosong
+    try:
+        writer = pd.ExcelWriter(buffer, engine="xlsxwriter")
+    except ImportError:
+        writer = pd.ExcelWriter(buffer, engine="openpyxl")
+    with writer:
         df.to_excel(writer, index=False, sheet_name="APBD")
-    buffer.seek(0)
-    return buffer
+    return buffer.getvalue()
 
 # =======================================================
 # 🔧 Helper — parse angka & formatting
 # =======================================================
+# Regex dikompilasi sekali di level modul — dipakai per sel / per kolom
+_RE_NONNUM = re.compile(r"[^\d\.,\-]")
+_RE_NONNUM_STRICT = re.compile(r"[^\d\.\-]")
+_RE_DEC_TAIL = re.compile(r"\.\d{1,2}$")
+# tabel translate untuk jalur skalar — hapus "rp", mata uang, dan spasi sekali scan
+_STRIP_TABLE = str.maketrans("", "", "rp$€£ \t\n\xa0")
+
 def format_rupiah(x):
     """Format angka menjadi 1.234.567.890"""
     try:
@@ -38,43 +53,257 @@ def format_rupiah(x):
     except:
         return x
 
+def format_rupiah_series(s):
+    """Versi vektor format_rupiah — untuk kolom tampilan."""
+    return s.map("{:,.0f}".format).str.replace(",", ".", regex=False)
+
 def parse_number(x):
+    """Fallback skalar — untuk nilai tunggal di luar pipeline pandas."""
     if pd.isna(x):
         return 0.0
     if isinstance(x, (int,float,np.integer,np.floating)):
         return float(x)
 
-    s=str(x).lower()
-    s = s.replace("rp","").replace(" ", "")
+    s = str(x).lower().translate(_STRIP_TABLE)
 
-    if "(" in s and ")" in s:
-        s = "-" + s.replace("(", "").replace(")", "")
+    # jalur cepat: nilai polos tanpa pemisah/kurung — mayoritas ekspor portal
+    if "." not in s and "," not in s and "(" not in s:
+        try:
+            return float(s)
+        except ValueError:
+            pass
 
-    # jika ada titik & koma → asumsikan titik = ribuan
-    if "." in s and "," in s:
-        s = s.replace(".","").replace(",",".")
-    else:
-        if "." in s and re.search(r"\.\d{1,2}$",s) is None:
+    neg = s.startswith("(") and s.endswith(")")
+    if neg:
+        s = s[1:-1]
+
+    # jika ada titik & koma → asumsikan titik = ribuan;
+    # titik tanpa 1-2 digit desimal di ujung juga dianggap ribuan
+    if "." in s:
+        tail = s[s.rfind(".")+1:]
+        if "," in s or not (tail.isdigit() and len(tail) <= 2):
             s = s.replace(".", "")
-        s = s.replace(",", ".")
+    s = s.replace(",", ".")
 
-    s = re.sub(r"[^\d\.\-]", "", s)
     try:
-        return float(s)
-    except:
+        v = float(s)
+    except ValueError:
+        try:
+            v = float(_RE_NONNUM_STRICT.sub("", s))
+        except ValueError:
+            return 0.0
+    return -v if neg else v
+
+# numba opsional — kalau terpasang, parsing massal jalan sebagai kernel native
+try:
+    from numba import njit as _njit
+except ImportError:
+    _njit = None
+
+if _njit is not None:
+    # cache=True: hasil kompilasi disimpan ke disk, proses server baru tidak
+    # perlu kompilasi ulang (~1 detik) saat upload pertama
+    @_njit(cache=True)
+    def _parse_cells_numba(data, offsets):
+        """Parse tiap sel (bytes ASCII lowercase) ke float64, heuristik sama
+        dengan parse_number: kurung = negatif, titik ribuan vs desimal."""
+        n = offsets.shape[0] - 1
+        out = np.zeros(n, dtype=np.float64)
+        for i in range(n):
+            start = offsets[i]
+            end = offsets[i+1]
+
+            # karakter signifikan pertama/terakhir (abaikan r, p, spasi)
+            first = -1
+            last = -1
+            for j in range(start, end):
+                c = data[j]
+                if c != 114 and c != 112 and c != 32:  # r, p, spasi
+                    if first < 0:
+                        first = j
+                    last = j
+            neg_paren = (first >= 0 and data[first] == 40 and data[last] == 41)
+
+            # pass 1: statistik karakter yang lolos pembersihan
+            ndot = 0
+            ncomma = 0
+            clean_len = 0
+            last_dot_pos = -1
+            minus_pos = -1
+            nminus = 0
+            for j in range(start, end):
+                c = data[j]
+                if 48 <= c <= 57:
+                    clean_len += 1
+                elif c == 46:  # .
+                    ndot += 1
+                    last_dot_pos = clean_len
+                    clean_len += 1
+                elif c == 44:  # ,
+                    ncomma += 1
+                    clean_len += 1
+                elif c == 45:  # -
+                    nminus += 1
+                    minus_pos = clean_len
+                    clean_len += 1
+
+            if clean_len == 0:
+                continue
+            if nminus > 1 or (nminus == 1 and minus_pos != 0):
+                continue
+
+            # ekor desimal: titik terakhir diikuti 1-2 digit sampai akhir
+            tail_len = clean_len - last_dot_pos - 1
+            dec_tail = ndot > 0 and ncomma == 0 and 1 <= tail_len <= 2
+            dots_thousands = ndot > 0 and (ncomma > 0 or not dec_tail)
+
+            nsep = ncomma + (0 if dots_thousands else ndot)
+            if nsep > 1:
+                continue
+
+            # pass 2: akumulasi nilai
+            val = 0.0
+            frac_div = 0.0
+            has_digit = False
+            bad = False
+            for j in range(start, end):
+                c = data[j]
+                if 48 <= c <= 57:
+                    has_digit = True
+                    if frac_div > 0.0:
+                        val += (c - 48) / frac_div
+                        frac_div *= 10.0
+                    else:
+                        val = val * 10.0 + (c - 48)
+                elif c == 46 and not dots_thousands:
+                    if frac_div > 0.0:
+                        bad = True
+                        break
+                    frac_div = 10.0
+                elif c == 44 and ncomma > 0:
+                    if frac_div > 0.0:
+                        bad = True
+                        break
+                    frac_div = 10.0
+            if bad or not has_digit:
+                continue
+            if nminus == 1:
+                val = -val
+            if neg_paren:
+                val = -val
+            out[i] = val
+        return out
+
+    def _parse_number_series_numba(s):
+        b = s.fillna("").astype(str).str.lower().str.encode("ascii", "ignore")
+        lens = b.str.len().to_numpy(dtype=np.int64)
+        offsets = np.empty(len(b)+1, dtype=np.int64)
+        offsets[0] = 0
+        np.cumsum(lens, out=offsets[1:])
+        data = np.frombuffer(b"".join(b.tolist()), dtype=np.uint8)
+        return pd.Series(_parse_cells_numba(data, offsets), index=s.index)
+else:
+    _parse_cells_numba = None
+
+def parse_number_series(s):
+    """Versi vektor dari parse_number — seluruh kolom sekali jalan di pandas."""
+    if _parse_cells_numba is not None:
+        return _parse_number_series_numba(s)
+
+    if s.dtype == object:
+        s = s.astype("string")
+    s = s.fillna("").str.lower().str.strip()
+    s = s.str.replace("rp", "", regex=False).str.replace(" ", "", regex=False)
+
+    # jalur cepat: kolom yang seluruhnya angka polos langsung ke to_numeric
+    if bool(s.str.fullmatch(r"-?\d*", na=False).all()):
+        return pd.to_numeric(s, errors="coerce").fillna(0.0).astype("float64")
+
+    neg = s.str.startswith("(") & s.str.endswith(")")
+    s = s.where(~neg, s.str[1:-1])
+
+    s = s.str.replace(_RE_NONNUM, "", regex=True)
+
+    # jika ada titik & koma → asumsikan titik = ribuan;
+    # titik tunggal tanpa pola desimal di ujung juga dianggap ribuan
+    has_dot = s.str.contains(".", regex=False)
+    has_comma = s.str.contains(",", regex=False)
+    dot_thousands = has_dot & (has_comma | ~s.str.contains(_RE_DEC_TAIL, regex=True))
+    s = s.where(~dot_thousands, s.str.replace(".", "", regex=False))
+    s = s.str.replace(",", ".", regex=False)
+
+    out = pd.to_numeric(s, errors="coerce").fillna(0.0).astype("float64")
+    return out.mask(neg, -out)
+
+def find_columns(columns, spec):
+    """Deteksi semua kolom target sekali jalan — header di-lowercase sekali.
+    spec: {nama_logis: [keyword, ...]}; hasil: {nama_logis: kolom atau None}."""
+    lower_cols = [(c, str(c).lower()) for c in columns]
+    found = {}
+    for name, keywords in spec.items():
+        found[name] = None
+        for k in keywords:
+            kl = k.lower()
+            hit = next((c for c, cl in lower_cols if kl in cl), None)
+            if hit is not None:
+                found[name] = hit
+                break
+    return found
+
+def numeric_score(col):
+    """Skor 0-1: porsi sampel kolom yang bisa diparse jadi angka."""
+    v = col.dropna().head(50).astype(str).str.replace(_RE_NONNUM, "", regex=True)
+    v = v[v.str.len() > 0]
+    if v.empty:
         return 0.0
-
-def find_column_by_keywords(df, keywords):
-    for k in keywords:
-        for c in df.columns:
-            if k.lower() in str(c).lower():
-                return c
-    return None
+    parsed = pd.to_numeric(
+        v.str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
+        errors="coerce")
+    return float(parsed.notna().mean())
 
 # =======================================================
 # 🔧 Klasifikasi akun
 # =======================================================
+# Urutan menentukan prioritas — kategori pertama yang cocok menang.
+# Keyword polos dicek sebagai substring literal (regex=False, lebih cepat);
+# yang butuh batas kata / awal string ditulis sebagai regex.
+_CATEGORY_KEYWORDS = [
+    ("PAD", [r"\bpad\b", "pajak", "retribusi", "hasil pengelolaan"]),
+    ("TRANSFER", ["transfer", "tkdd", r"\bdau\b", r"\bdak\b"]),
+    ("PENDAPATAN", [r"^pendapatan"]),
+    ("BELANJA_OPERASI", ["belanja pegawai", "barang", "jasa"]),
+    ("BELANJA_MODAL", ["belanja modal"]),
+    ("BELANJA_LAINNYA", ["subsidi", "hibah", "bantuan"]),
+    ("BELANJA_TIDAK_TERDUGA", ["tidak terduga"]),
+    ("PEMBIAYAAN", ["pembiayaan"]),
+]
+
+# dtype kategori tetap — groupby pakai kode integer, bukan hash string per baris
+KATEGORI_DTYPE = pd.CategoricalDtype([c for c, _ in _CATEGORY_KEYWORDS] + ["LAINNYA"])
+BELANJA_SET = frozenset(
+    c for c, _ in _CATEGORY_KEYWORDS if c.startswith("BELANJA"))
+
+def classify_series(names):
+    """Versi vektor dari classify_account — satu scan per keyword, bukan per baris.
+    Nama akun banyak berulang antar baris/tahun, jadi klasifikasi hanya
+    dijalankan pada nama unik lalu dipetakan balik."""
+    if names.dtype == object:
+        names = names.astype("string")
+    n = names.str.lower()
+    uniq = pd.Series(n.dropna().unique())
+    conds = []
+    for _, kws in _CATEGORY_KEYWORDS:
+        mask = None
+        for kw in kws:
+            m = uniq.str.contains(kw, regex="\\" in kw or "^" in kw, na=False)
+            mask = m if mask is None else mask | m
+        conds.append(mask.to_numpy(dtype=bool))
+    cats = np.select(conds, [c for c, _ in _CATEGORY_KEYWORDS], default="LAINNYA")
+    lookup = dict(zip(uniq.tolist(), cats.tolist()))
+    return n.map(lookup).fillna("LAINNYA").astype(object)
+
 def classify_account(name):
+    """Fallback skalar — untuk nilai tunggal di luar pipeline pandas."""
     n = str(name).lower()
     if "pad" in n or "pajak" in n or "retribusi" in n or "hasil pengelolaan" in n:
         return "PAD"
@@ -108,6 +337,37 @@ def interpret_ratio(name, value):
     else:
         return f"Rasio *{name}* rendah ({value:.2f}%). Mengindikasikan potensi masalah efisiensi/kemandirian fiskal."
 
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df):
+    """Serialisasi CSV untuk tombol download — writer Arrow bila tersedia,
+    dicache per isi frame supaya tidak diulang tiap rerun."""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        buf = io.BytesIO()
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+        return buf.getvalue()
+    except ImportError:
+        return df.to_csv(index=False).encode("utf-8")
+
+# =======================================================
+# 🔧 Visual
+# =======================================================
+@st.cache_data(show_spinner=False)
+def build_composition_pie(bo, bm, other):
+    """Figure hanya tergantung tiga angka — cache per kombinasi nilai."""
+    comp = pd.DataFrame({
+        "Kategori":["Belanja Operasi","Belanja Modal","Lainnya"],
+        "Nilai":[bo, bm, other]
+    })
+    return px.pie(comp, names="Kategori", values="Nilai", title="Komposisi Belanja")
+
+@st.cache_data(show_spinner=False)
+def build_trend_line(trend):
+    return px.line(trend, x="TahunInt", y="Realisasi", markers=True,
+                   title="Tren Realisasi per Tahun",
+                   labels={"TahunInt": "Tahun"})
+
 # =======================================================
 # 📂 SIDEBAR
 # =======================================================
@@ -126,104 +386,250 @@ if page == "Home":
 # =======================================================
 elif page == "Download Template":
     st.subheader("Download Template")
-    st.download_button("Download template APBD", make_template_excel(), "template_apbd.xlsx")
+    st.download_button("Download template APBD", build_template_bytes(), "template_apbd.xlsx")
 
 # =======================================================
 # UPLOAD & ANALISIS
 # =======================================================
 elif page == "Upload & Analisis":
+
+    @st.cache_data(show_spinner=False)
+    def load_and_clean(file_bytes):
+        """Pipeline berat (baca Excel, bersihkan, aggregasi, rasio) — dicache
+        per isi file supaya rerun Streamlit tidak mengulang dari nol."""
+        # calamine (Rust) jauh lebih cepat dari openpyxl; fallback kalau belum terpasang.
+        # Kolom non-jumlah boleh tipe asli, tapi kolom jumlah WAJIB dibaca sebagai
+        # teks: inferensi numerik read_excel memakai locale US, jadi sel teks
+        # "250.000" berubah jadi float 250.0 — salah 1000x tanpa error
+        def read_excel(**kwargs):
+            try:
+                return pd.read_excel(io.BytesIO(file_bytes), sheet_name=0, engine="calamine", **kwargs)
+            except ImportError:
+                return pd.read_excel(io.BytesIO(file_bytes), sheet_name=0, **kwargs)
+
+        # ---------------- detect kolom -------------------
+        # baca header dulu; kalau semua kolom ketemu lewat keyword, baca ulang
+        # hanya kolom yang dipakai (engine melewati sel lainnya)
+        header = read_excel(nrows=0)
+        detected = find_columns(header.columns, {
+            "akun": ["akun","uraian","nama","rekening"],
+            "anggaran": ["anggaran","pagu","nilai"],
+            "realisasi": ["realisasi"],
+            "tahun": ["tahun","year"],
+        })
+        akun_col = detected["akun"] if detected["akun"] is not None else header.columns[0]
+        anggaran_col = detected["anggaran"]
+        realisasi_col = detected["realisasi"]
+        tahun_col = detected["tahun"]
+
+        if anggaran_col is not None and realisasi_col is not None:
+            usecols = list(dict.fromkeys(
+                c for c in (akun_col, anggaran_col, realisasi_col, tahun_col) if c is not None))
+            raw = read_excel(usecols=usecols,
+                             dtype={anggaran_col: str, realisasi_col: str})
+            # preview tetap menampilkan sheet utuh walau pipeline hanya
+            # membaca kolom terpakai — cukup beberapa baris pertama
+            preview = read_excel(nrows=5)
+        else:
+            # fallback skor numerik butuh data semua kolom; semuanya sebagai
+            # teks karena kolom jumlah belum diketahui
+            raw = read_excel(dtype=str)
+            preview = raw.head()
+
+        # fallback: kalau keyword tidak cocok, pakai kolom dengan skor numerik
+        # tertinggi. Sort hanya pada skor (negatif, sort stabil) supaya skor
+        # seri mengikuti urutan kolom di sheet — Anggaran lazim di kiri
+        # Realisasi — dan label kolom tak pernah ikut dibandingkan
+        if anggaran_col is None or realisasi_col is None:
+            taken = {akun_col, anggaran_col, realisasi_col, tahun_col}
+            candidates = sorted(
+                ((numeric_score(raw[c]), c) for c in raw.columns if c not in taken),
+                key=lambda t: -t[0])
+            candidates = [c for s, c in candidates if s > 0.8]
+            if anggaran_col is None and candidates:
+                anggaran_col = candidates.pop(0)
+            if realisasi_col is None and candidates:
+                realisasi_col = candidates.pop(0)
+
+        if anggaran_col is None or realisasi_col is None:
+            raise ValueError("Kolom Anggaran/Realisasi tidak ditemukan. Ubah nama header atau pakai template.")
+
+        # proyeksikan hanya kolom yang dipakai — jangan salin seluruh sheet.
+        # Pakai pasangan (sumber, tujuan), bukan dict keyed sumber: satu kolom
+        # fisik boleh mengisi dua peran (mis. fallback akun = kolom pertama
+        # yang kebetulan juga kolom Anggaran) dan dict akan menelannya.
+        roles = [(akun_col, "Akun"), (anggaran_col, "Anggaran"), (realisasi_col, "Realisasi")]
+        if tahun_col is not None:
+            roles.append((tahun_col, "Tahun"))
+        df = pd.DataFrame({new: raw[old] for old, new in roles})
+        names = [new for _, new in roles]
+
+        # string Arrow (kalau pyarrow terpasang) — kernel .str jalan di
+        # buffer UTF-8 kontigu, bukan objek string Python per sel
+        try:
+            for c in names:
+                if df[c].dtype == object:
+                    df[c] = df[c].astype("string[pyarrow]")
+        except ImportError:
+            pass
+
+        def to_numeric_col(col):
+            if pd.api.types.is_numeric_dtype(col):
+                out = col.fillna(0.0).astype("float64")
+            else:
+                out = parse_number_series(col)
+            # nilai APBD umumnya bulat — simpan sebagai int64 bila lossless;
+            # float32 TIDAK dipakai karena kehilangan presisi rupiah
+            arr = out.to_numpy()
+            if arr.size and np.isfinite(arr).all() and (arr == np.trunc(arr)).all():
+                return out.astype("int64")
+            return out
+
+        df["Anggaran_num"]=to_numeric_col(df["Anggaran"])
+        df["Realisasi_num"]=to_numeric_col(df["Realisasi"])
+        # satu pass tanpa temporary penuh: baris ber-anggaran 0 tidak ikut dibagi
+        a = df["Anggaran_num"].to_numpy(dtype="float64")
+        r = df["Realisasi_num"].to_numpy(dtype="float64")
+        persen = np.zeros(len(df), dtype="float64")
+        np.divide(r, a, out=persen, where=a > 0)
+        df["Persen"] = persen * 100
+
+        df["Kategori"]=classify_series(df["Akun"]).astype(KATEGORI_DTYPE)
+
+        agg = df.groupby("Kategori", sort=False, observed=True)[["Anggaran_num","Realisasi_num"]].sum().reset_index()
+
+        # lookup O(1) per kategori, bukan scan boolean-mask berulang atas agg
+        real = agg.set_index("Kategori")["Realisasi_num"]
+        belanja_mask = real.index.isin(BELANJA_SET)
+        totals = {
+            "PAD": float(real.get("PAD", 0.0)),
+            "TRANSFER": float(real.get("TRANSFER", 0.0)),
+            "BELANJA_OPERASI": float(real.get("BELANJA_OPERASI", 0.0)),
+            "BELANJA_MODAL": float(real.get("BELANJA_MODAL", 0.0)),
+            "TOTAL_BELANJA": float(real[belanja_mask].sum()),
+            "ANGGARAN_TOTAL": float(df["Anggaran_num"].sum()),
+            "REALISASI_TOTAL": float(df["Realisasi_num"].sum()),
+        }
+
+        # total tahun sebelumnya — satu groupby (Tahun, Kategori), bukan
+        # filter per tahun lalu scan ulang per kategori
+        totals_prev = None
+        trend = None
+        if "Tahun" in df.columns:
+            # tahun diparse jadi integer — "2024" dan "2024.0" jatuh ke kunci
+            # yang sama, dan sort/banding antar tahun jalan di level int
+            df["TahunInt"] = pd.to_numeric(df["Tahun"], errors="coerce").astype("Int32")
+            t = df.groupby(["TahunInt","Kategori"], observed=True)["Realisasi_num"].sum().unstack(fill_value=0.0)
+            trend = t.sum(axis=1).rename("Realisasi").reset_index()
+            if len(t.index) >= 2:
+                years_sorted = list(t.index)
+                # mask kolom dihitung sekali, dipakai untuk semua tahun
+                belanja_cols = t.columns.isin(BELANJA_SET)
+                pendapatan_cols = t.columns.isin(["PAD","TRANSFER","PENDAPATAN"])
+
+                def year_totals(row):
+                    return {
+                        "PAD": float(row.get("PAD", 0.0)),
+                        "TRANSFER": float(row.get("TRANSFER", 0.0)),
+                        "PENDAPATAN_TOTAL": float(row[pendapatan_cols].sum()),
+                        "TOTAL_BELANJA": float(row[belanja_cols].sum()),
+                        "REALISASI_TOTAL": float(row.sum()),
+                    }
+
+                totals_prev = {
+                    "TAHUN_PREV": years_sorted[-2],
+                    "TAHUN_CURR": years_sorted[-1],
+                    "prev": year_totals(t.loc[years_sorted[-2]]),
+                    "curr": year_totals(t.loc[years_sorted[-1]]),
+                }
+
+        def safe(a,b):
+            return a/b*100 if b>0 else 0
+
+        rasio = {
+            "Kemandirian (PAD/Transfer)": safe(totals["PAD"],totals["TRANSFER"]),
+            "Belanja Operasi / Total Belanja": safe(totals["BELANJA_OPERASI"],totals["TOTAL_BELANJA"]),
+            "Belanja Modal / Total Belanja": safe(totals["BELANJA_MODAL"],totals["TOTAL_BELANJA"]),
+            "Efektivitas Pendapatan (Realisasi / Anggaran Pendapatan)": safe(totals["REALISASI_TOTAL"], totals["ANGGARAN_TOTAL"]),
+            "Efisiensi Belanja (Realisasi Belanja / Anggaran Belanja)": safe(totals["TOTAL_BELANJA"], totals["ANGGARAN_TOTAL"])
+        }
+
+        return preview, df, agg, totals, totals_prev, trend, rasio
+
     file = st.file_uploader("Upload file APBD (.xlsx)", type=["xlsx"])
     if file is None:
         st.stop()
 
     try:
-        raw = pd.read_excel(file, dtype=str)
+        preview, df, agg, totals, totals_prev, trend, rasio = load_and_clean(file.getvalue())
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
     except Exception as e:
         st.error("Gagal membaca file: " + str(e))
         st.stop()
 
     st.subheader("Preview Data Mentah")
-    st.dataframe(raw.head())
-
-    # ---------------- detect kolom -------------------
-    akun_col = find_column_by_keywords(raw, ["akun","uraian","nama","rekening"]) or raw.columns[0]
-    anggaran_col = find_column_by_keywords(raw, ["anggaran","pagu","nilai"])
-    realisasi_col = find_column_by_keywords(raw, ["realisasi"])
-
-    if anggaran_col is None or realisasi_col is None:
-        st.error("Kolom Anggaran/Realisasi tidak ditemukan. Ubah nama header atau pakai template.")
-        st.stop()
-
-    df = raw[[akun_col,anggaran_col,realisasi_col]].copy()
-    df.columns=["Akun","Anggaran","Realisasi"]
-
-    df["Anggaran_num"]=df["Anggaran"].apply(parse_number)
-    df["Realisasi_num"]=df["Realisasi"].apply(parse_number)
-    df["Persen"]=np.where(df["Anggaran_num"]>0, df["Realisasi_num"]/df["Anggaran_num"]*100, 0)
-
-    df["Kategori"]=df["Akun"].apply(classify_account)
+    st.dataframe(preview)
 
     st.subheader("Data Setelah Dibersihkan")
-    df_show = df.copy()
-    df_show["Anggaran_fmt"] = df["Anggaran_num"].apply(format_rupiah)
-    df_show["Realisasi_fmt"] = df["Realisasi_num"].apply(format_rupiah)
-    st.dataframe(df_show.head(40))
+    # format hanya 40 baris yang ditampilkan, bukan seluruh frame
+    df_show = df.head(40).copy()
+    df_show["Anggaran_fmt"] = format_rupiah_series(df_show["Anggaran_num"])
+    df_show["Realisasi_fmt"] = format_rupiah_series(df_show["Realisasi_num"])
+    st.dataframe(df_show)
 
     # =======================
     # AGGREGATE
     # =======================
-    agg = df.groupby("Kategori")[["Anggaran_num","Realisasi_num"]].sum().reset_index()
-
     st.subheader("Aggregasi per Kategori")
     agg_show = agg.copy()
-    agg_show["Anggaran_fmt"]=agg["Anggaran_num"].apply(format_rupiah)
-    agg_show["Realisasi_fmt"]=agg["Realisasi_num"].apply(format_rupiah)
+    agg_show["Anggaran_fmt"]=format_rupiah_series(agg["Anggaran_num"])
+    agg_show["Realisasi_fmt"]=format_rupiah_series(agg["Realisasi_num"])
     st.dataframe(agg_show)
 
     # =======================
     # HITUNG RASIO LENGKAP
     # =======================
-    PAD = agg[agg["Kategori"]=="PAD"]["Realisasi_num"].sum()
-    TRANSFER = agg[agg["Kategori"]=="TRANSFER"]["Realisasi_num"].sum()
-    BO = agg[agg["Kategori"]=="BELANJA_OPERASI"]["Realisasi_num"].sum()
-    BM = agg[agg["Kategori"]=="BELANJA_MODAL"]["Realisasi_num"].sum()
-    TOTAL_BELANJA = agg[agg["Kategori"].str.contains("BELANJA")]["Realisasi_num"].sum()
-
-    def safe(a,b):
-        return a/b*100 if b>0 else 0
-
-    rasio = {
-        "Kemandirian (PAD/Transfer)": safe(PAD,TRANSFER),
-        "Belanja Operasi / Total Belanja": safe(BO,TOTAL_BELANJA),
-        "Belanja Modal / Total Belanja": safe(BM,TOTAL_BELANJA),
-        "Efektivitas Pendapatan (Realisasi / Anggaran Pendapatan)": df["Realisasi_num"].sum() / df["Anggaran_num"].sum() * 100,
-        "Efisiensi Belanja (Realisasi Belanja / Anggaran Belanja)": safe(TOTAL_BELANJA, df["Anggaran_num"].sum())
-    }
-
     st.subheader("📈 Rasio Keuangan Lengkap")
     for k,v in rasio.items():
         st.metric(k, f"{v:.2f}%")
 
+    # =======================
+    # PERBANDINGAN TAHUN SEBELUMNYA
+    # =======================
+    if totals_prev is not None:
+        st.subheader(f"📅 Tahun {totals_prev['TAHUN_CURR']} vs {totals_prev['TAHUN_PREV']}")
+        for key, label in [("PAD","PAD"),("TRANSFER","Transfer"),
+                           ("PENDAPATAN_TOTAL","Total Pendapatan"),
+                           ("TOTAL_BELANJA","Total Belanja"),("REALISASI_TOTAL","Total Realisasi")]:
+            curr_v = totals_prev["curr"][key]
+            prev_v = totals_prev["prev"][key]
+            delta = (curr_v-prev_v)/prev_v*100 if prev_v > 0 else 0
+            st.metric(label, format_rupiah(curr_v), f"{delta:.2f}%")
+
     # =======================
     # INTERPRETASI AUTO (TANPA API)
     # =======================
     st.subheader("🧠 Interpretasi AI (tanpa API key)")
-    for k,v in rasio.items():
-        st.markdown(f"{k}** → {interpret_ratio(k, v)}")
+    # satu st.markdown untuk semua baris — bukan satu elemen per rasio per rerun
+    st.markdown("\n\n".join(
+        f"**{k}** → {interpret_ratio(k, v)}" for k, v in rasio.items()))
 
     # =======================
     # VISUAL
     # =======================
+    if trend is not None and len(trend) >= 2:
+        st.subheader("Tren Realisasi per Tahun")
+        st.plotly_chart(build_trend_line(trend))
+
     st.subheader("Visualisasi Belanja")
-    comp = pd.DataFrame({
-        "Kategori":["Belanja Operasi","Belanja Modal","Lainnya"],
-        "Nilai":[BO, BM, TOTAL_BELANJA-BO-BM]
-    })
-    fig = px.pie(comp, names="Kategori", values="Nilai", title="Komposisi Belanja")
+    BO, BM, TOTAL_BELANJA = totals["BELANJA_OPERASI"], totals["BELANJA_MODAL"], totals["TOTAL_BELANJA"]
+    fig = build_composition_pie(BO, BM, TOTAL_BELANJA-BO-BM)
     st.plotly_chart(fig)
 
     # =======================
     # DOWNLOAD
     # =======================
     st.subheader("Download Hasil Aggregasi")
-    st.download_button("Download CSV", agg.to_csv(index=False).encode(), "apbd_aggregated.csv")
+    st.download_button("Download CSV", to_csv_bytes(agg), "apbd_aggregated.csv")